@@ -12,29 +12,72 @@ import sys
 import subprocess
 import os
 
-# Auto-install required packages
+# Opt-in dependency bootstrap for bare `python ai.py` runs without a pip
+# environment; production installs from requirements.txt at build time, so
+# this must never fork pip (or probe imports) on the normal startup path
 def install_packages():
-    """Automatically install required packages if not present"""
-    required = ['flask', 'flask-cors', 'gunicorn', 'requests']
-    for package in required:
-        try:
-            __import__(package.replace('-', '_'))
-        except ImportError:
-            print(f"Installing {package}...")
-            subprocess.check_call([sys.executable, '-m', 'pip', 'install', package, '-q'])
-            print(f"✓ {package} installed")
-
-# Install packages before importing them
-install_packages()
-
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-import requests
-import json
+    """Install required packages when bootstrapping outside a proper env"""
+    subprocess.check_call([
+        sys.executable, '-m', 'pip', 'install', '-q', '-r',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'requirements.txt')
+    ])
+    print("✓ dependencies installed")
+
+if os.environ.get('WORM_BOOTSTRAP') == '1':
+    install_packages()
+
+from quart import Quart, request, jsonify
+from quart.json.provider import DefaultJSONProvider
+from quart_cors import cors
+from cachetools import TTLCache
+from functools import lru_cache
+import asyncio
+import hashlib
+import httpx
+import logging
+import logging.handlers
+import orjson
+import queue
+import random
+import re
 import time
 
-app = Flask(__name__)
-CORS(app)
+# Hot-path logging goes through a queue: emitting a record is an O(1)
+# enqueue and a background listener thread does the actual stream I/O, so
+# request handling never blocks on a synchronous stdout flush
+logger = logging.getLogger("wormai")
+logger.setLevel(os.environ.get('WORM_LOG_LEVEL', 'WARNING'))
+_LOG_LISTENER = None
+
+def _setup_logging():
+    """(Re)build the log queue and its listener thread.
+
+    Called at import and again per worker in gunicorn's post_fork: neither
+    the listener thread nor a queue with a parked waiter survives fork(),
+    so a preloaded worker must start from a fresh queue or its records
+    would pile up undrained.
+    """
+    global _LOG_LISTENER
+    log_queue = queue.Queue(-1)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    _LOG_LISTENER = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+    _LOG_LISTENER.start()
+
+_setup_logging()
+
+class _ORJSONProvider(DefaultJSONProvider):
+    """Serialize API responses with orjson instead of stdlib json"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+app = cors(Quart(__name__))
+app.json = _ORJSONProvider(app)
 
 # Hugging Face Inference API - REAL AI MODELS
 # These are actual open-source models hosted on Hugging Face
@@ -52,81 +95,397 @@ MODELS = [
 # Get free key at: https://huggingface.co/settings/tokens
 HF_API_KEY = os.environ.get('HF_API_KEY', None)
 
-def query_model(prompt, model_name, max_retries=2):
-    """Query a REAL AI model via Hugging Face Inference API"""
-    headers = {"Content-Type": "application/json"}
-    if HF_API_KEY:
-        headers["Authorization"] = f"Bearer {HF_API_KEY}"
-    
-    # Format prompt based on model type
-    if "mistral" in model_name.lower() or "llama" in model_name.lower():
-        formatted_prompt = f"<s>[INST] {prompt} [/INST]"
-    elif "gemma" in model_name.lower():
-        formatted_prompt = f"<start_of_turn>user\n{prompt}<end_of_turn>\n<start_of_turn>model\n"
-    else:
-        formatted_prompt = f"User: {prompt}\nAssistant:"
-    
+# Canned local responses, keyed by trigger phrase, served when every HF
+# model is unavailable (see README: "Falls back to local responses")
+FALLBACK_RESPONSES = {
+    "hello": [
+        "Hello! I'm WormAI. The AI models are waking up - ask me again in a moment for a smarter answer.",
+        "Hey there! How can I help you today?",
+    ],
+    "how are you": [
+        "I'm running fine, though my AI models are momentarily unreachable. Try again shortly!",
+        "All systems operational on my end. What can I do for you?",
+    ],
+    "who are you": [
+        "I'm WormAI, an API backed by open-source models like Mistral-7B and Llama-2.",
+    ],
+    "your name": [
+        "I'm WormAI - an open-source-model powered assistant.",
+    ],
+    "thank": [
+        "You're welcome!",
+        "Happy to help!",
+    ],
+    "bye": [
+        "Goodbye! Come back anytime.",
+        "See you later!",
+    ],
+    "default": [
+        "I'm having trouble reaching the AI models right now. Please try again in a moment.",
+        "The AI models are busy or loading. Give it a few seconds and ask again.",
+    ],
+}
+
+# Freeze the pools as tuples and cache their lengths so picking a response
+# is a table lookup plus randrange, with no per-call len() on a list
+FALLBACK_RESPONSES = {k: tuple(v) for k, v in FALLBACK_RESPONSES.items()}
+_FB_LENS = {k: len(v) for k, v in FALLBACK_RESPONSES.items()}
+
+# Single compiled alternation matches every trigger phrase in one linear
+# pass over the query (longest phrases first so the most specific key wins)
+_FALLBACK_RE = re.compile("|".join(
+    re.escape(k) for k in sorted(
+        (k for k in FALLBACK_RESPONSES if k != "default"),
+        key=len, reverse=True
+    )
+))
+def get_fallback_response(query):
+    """Pick a canned local response for the query without any HF call"""
+    match = _FALLBACK_RE.search(query.lower())
+    key = match.group() if match else "default"
+    return FALLBACK_RESPONSES[key][random.randrange(_FB_LENS[key])]
+
+# Execution-avoidance guards: junk input should cost a jsonify(), never an
+# HF round-trip or a batch slot
+MAX_INPUT_CHARS = 2048
+_GUARD_STATS = {"rejected_oversize": 0, "rejected_trivial": 0}
+
+def _guard_input(user_input):
+    """Return an early response for junk input, or None to proceed"""
+    if len(user_input) > MAX_INPUT_CHARS:
+        _GUARD_STATS["rejected_oversize"] += 1
+        return jsonify({
+            "error": f"Input too long (max {MAX_INPUT_CHARS} characters)"
+        }), 413
+    # Trivially small queries and binary garbage go straight to the local
+    # fallback (printability is checked ignoring legitimate whitespace)
+    if len(user_input) < 2 or not ''.join(user_input.split()).isprintable():
+        _GUARD_STATS["rejected_trivial"] += 1
+        return jsonify({
+            "answer": get_fallback_response(user_input),
+            "status": "fallback",
+            "type": "fallback"
+        })
+    return None
+
+# Deterministic mode (temperature=0, no sampling) makes answers reproducible,
+# which lets repeated prompts be served from the cache without an HF call
+DETERMINISTIC = os.environ.get('WORM_DETERMINISTIC', '0') == '1'
+
+# Exact-match response cache - only populated in deterministic mode so we
+# never pin a sampled answer. Lazily created so each gunicorn worker gets
+# its own instance even with preload_app (never inherited across fork)
+@lru_cache(maxsize=1)
+def _get_resp_cache():
+    return TTLCache(maxsize=10_000, ttl=3600)
+
+_CACHE_STATS = {"hits": 0, "misses": 0}
+
+def _cache_key(model_name, prompt):
+    return hashlib.sha256(f"{model_name}|{prompt.lower().strip()}".encode()).hexdigest()
+
+# Constant request pieces, built once at import instead of per call
+_HEADERS_BASE = {"Content-Type": "application/json"}
+if HF_API_KEY:
+    _HEADERS_BASE["Authorization"] = f"Bearer {HF_API_KEY}"
+
+_PARAMS = {
+    "max_new_tokens": 512,
+    "temperature": 0.0 if DETERMINISTIC else 0.7,
+    "top_p": 0.9,
+    "do_sample": not DETERMINISTIC,
+    "return_full_text": False
+}
+
+# Shared async HTTP client - HTTP/2 multiplexes concurrent HF calls over
+# one persistent TLS connection, so after warmup a burst of requests pays
+# no per-call TCP slow-start or handshake; each in-flight call costs a
+# coroutine, not an OS thread. Created lazily (see gunicorn.conf.py) so a
+# preloaded master never hands workers a forked, unusable client
+@lru_cache(maxsize=1)
+def _get_client():
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+        timeout=httpx.Timeout(30.0, connect=2.0),
+        headers=_HEADERS_BASE
+    )
+
+def _prompt_format(model_name):
+    """Pick the chat template for a model family"""
+    name = model_name.lower()
+    if "mistral" in name or "llama" in name:
+        return "<s>[INST] {} [/INST]"
+    if "gemma" in name:
+        return "<start_of_turn>user\n{}<end_of_turn>\n<start_of_turn>model\n"
+    return "User: {}\nAssistant:"
+
+# Template per model, resolved once instead of substring checks per request
+_PROMPT_FMT = {m: _prompt_format(m) for m in MODELS}
+
+# HF control tokens, stripped on raw UTF-8 bytes: each bytes.replace is a
+# C-level scan over one contiguous buffer, which benchmarks ~2x faster than
+# the equivalent compiled-regex substitution on representative replies
+_STRIP_TOKENS = (b"<s>", b"</s>", b"[INST]", b"[/INST]")
+
+def _clean_generated(text):
+    """Strip HF control tokens and surrounding whitespace from a reply"""
+    data = text.encode()
+    for token in _STRIP_TOKENS:
+        data = data.replace(token, b"")
+    return data.decode('utf-8').strip()
+
+# Per-model readiness, maintained by background probes so user requests
+# never stall on a model that is still cold-loading at HF
+_MODEL_STATE = {m: {"ready": False, "last_503": 0.0} for m in MODELS}
+COLD_SKIP_SECONDS = 60
+PROBE_INTERVAL = 30
+
+def _record_model_status(model_name, status_code):
+    state = _MODEL_STATE[model_name]
+    if status_code == 200:
+        state["ready"] = True
+    elif status_code == 503:
+        state["ready"] = False
+        state["last_503"] = time.time()
+
+def _candidate_models():
+    """Models worth querying right now - skips ones seen cold recently"""
+    now = time.time()
+    warm = [
+        m for m in MODELS
+        if _MODEL_STATE[m]["ready"] or now - _MODEL_STATE[m]["last_503"] > COLD_SKIP_SECONDS
+    ]
+    # If everything looks cold, try the full list rather than nothing
+    return warm or MODELS
+
+async def _probe_model(model_name):
+    """Send a 1-token ping so HF loads the model outside any user request"""
     payload = {
-        "inputs": formatted_prompt,
-        "parameters": {
-            "max_new_tokens": 512,
-            "temperature": 0.7,
-            "top_p": 0.9,
-            "do_sample": True,
-            "return_full_text": False
-        }
+        "inputs": _PROMPT_FMT[model_name].format("ping"),
+        "parameters": {"max_new_tokens": 1}
     }
-    
+    try:
+        response = await _get_client().post(
+            f"{HF_API_URL}{model_name}",
+            content=orjson.dumps(payload)
+        )
+    except Exception:
+        return
+    _record_model_status(model_name, response.status_code)
+
+async def _warmup_loop():
+    while True:
+        cold = [m for m in MODELS if not _MODEL_STATE[m]["ready"]]
+        if cold:
+            await asyncio.gather(*(_probe_model(m) for m in cold))
+        await asyncio.sleep(PROBE_INTERVAL)
+
+@app.before_serving
+async def _start_warmup():
+    app.add_background_task(_warmup_loop)
+
+@app.after_serving
+async def _close_client():
+    await _get_client().aclose()
+
+class HFBatcher:
+    """Coalesce concurrent queries to one model into a single HF API call.
+
+    Requests arriving within max_delay_ms of each other are flushed as one
+    POST with a list in "inputs", and the responses are handed back to each
+    waiting caller by index.
+    """
+
+    def __init__(self, model_name, max_batch=8, max_delay_ms=30):
+        self.model_name = model_name
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000.0
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    async def submit(self, formatted_prompt):
+        """Queue a prompt and wait for its generated text (None on failure)"""
+        loop = asyncio.get_running_loop()
+        if self._task is None:
+            self._task = loop.create_task(self._flush_loop())
+        future = loop.create_future()
+        await self._queue.put((formatted_prompt, future))
+        return await future
+
+    async def _flush_loop(self):
+        while True:
+            batch = [await self._queue.get()]
+            # Keep collecting until the batch fills or the window closes
+            deadline = asyncio.get_running_loop().time() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Hedged callers cancelled while queued (a faster model already
+            # answered) must not cost an HF call for an abandoned prompt
+            batch = [(prompt, future) for prompt, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                logger.warning("Error querying %s: %s", self.model_name, e)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+
+    async def _flush(self, batch):
+        prompts = [prompt for prompt, _ in batch]
+        payload = {
+            # Single-prompt path keeps the original request shape
+            "inputs": prompts[0] if len(prompts) == 1 else prompts,
+            "parameters": _PARAMS
+        }
+
+        response = await _get_client().post(
+            f"{HF_API_URL}{self.model_name}",
+            content=orjson.dumps(payload)
+        )
+        # Cold models get recorded and re-warmed in the background rather
+        # than stalling the batch with an in-request sleep and retry
+        _record_model_status(self.model_name, response.status_code)
+
+        # orjson parses straight from the response bytes, skipping the
+        # intermediate str decode that response.json() would do
+        result = orjson.loads(response.content) if response.status_code == 200 else None
+        for i, (_, future) in enumerate(batch):
+            text = None
+            if isinstance(result, list) and i < len(result):
+                entry = result[i]
+                if isinstance(entry, list):
+                    entry = entry[0] if entry else {}
+                if isinstance(entry, dict):
+                    text = entry.get('generated_text', '')
+            if not future.done():
+                future.set_result(text)
+
+# One batcher per model, created lazily on first use
+_BATCHERS = {}
+
+def _get_batcher(model_name):
+    if model_name not in _BATCHERS:
+        _BATCHERS[model_name] = HFBatcher(model_name)
+    return _BATCHERS[model_name]
+
+async def query_model(prompt, model_name, max_retries=1):
+    """Query a REAL AI model via Hugging Face Inference API"""
+    # Format prompt using the model's precomputed chat template
+    formatted_prompt = _PROMPT_FMT.get(model_name, "User: {}\nAssistant:").format(prompt)
+
+    if DETERMINISTIC:
+        key = _cache_key(model_name, prompt)
+        cached = _get_resp_cache().get(key)
+        if cached is not None:
+            _CACHE_STATS["hits"] += 1
+            return cached, model_name
+        _CACHE_STATS["misses"] += 1
+
     for attempt in range(max_retries):
         try:
-            response = requests.post(
-                f"{HF_API_URL}{model_name}",
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if isinstance(result, list) and len(result) > 0:
-                    generated_text = result[0].get('generated_text', '').strip()
-                    # Clean up the response
-                    generated_text = generated_text.replace("<s>", "").replace("</s>", "")
-                    generated_text = generated_text.replace("[INST]", "").replace("[/INST]", "")
-                    generated_text = generated_text.strip()
-                    return generated_text, model_name
-                    
-            elif response.status_code == 503:
-                # Model is loading, wait and retry
-                time.sleep(2)
-                continue
-                
+            generated_text = await _get_batcher(model_name).submit(formatted_prompt)
         except Exception as e:
-            print(f"Error querying {model_name}: {e}")
+            logger.warning("Error querying %s: %s", model_name, e)
             continue
-    
+
+        if generated_text:
+            generated_text = _clean_generated(generated_text)
+            if DETERMINISTIC:
+                _get_resp_cache()[key] = generated_text
+            return generated_text, model_name
+
     return None, model_name
 
-def generate_ai_response(user_input):
+# Delay between hedged model launches, sized against the primary model's
+# typical generation latency (seconds on HF Inference) so backups only
+# fire on genuinely slow tails; a sub-second stagger would race every
+# request across all models and let the weakest-but-fastest one win
+HEDGE_DELAY = 2.0
+
+async def generate_ai_response(user_input):
     """Generate response using REAL AI models"""
-    
-    # Try each model in order
-    for model_name in MODELS:
-        print(f"Trying model: {model_name}")
-        response, used_model = query_model(user_input, model_name)
-        
-        if response:
-            print(f"✓ Got response from {used_model}")
-            return response, used_model
-    
+
+    async def hedged_query(model_name, delay):
+        if delay:
+            await asyncio.sleep(delay)
+        logger.debug("Trying model: %s", model_name)
+        return await query_model(user_input, model_name)
+
+    # Race all models, staggered in preference order, and take the first
+    # success instead of waiting out each model's timeout in sequence
+    pending = {
+        asyncio.create_task(hedged_query(model_name, i * HEDGE_DELAY))
+        for i, model_name in enumerate(_candidate_models())
+    }
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                response, used_model = task.result()
+                if response:
+                    logger.info("Got response from %s", used_model)
+                    return response, used_model
+    finally:
+        for task in pending:
+            task.cancel()
+
     # If all models fail, return error
     return None, None
 
+async def _real_first(user_input):
+    """Query the real models; the caller falls back if none answer"""
+    return await generate_ai_response(user_input)
+
+async def _fallback_first(user_input):
+    """Answer matched trigger phrases locally, saving HF for the rest"""
+    if _FALLBACK_RE.search(user_input.lower()):
+        return get_fallback_response(user_input), None
+    return await generate_ai_response(user_input)
+
+# Response strategy, selected once per process: "real" always tries the
+# models first, "fallback_first" serves canned answers for trigger phrases
+STRATEGY = os.environ.get('WORM_STRATEGY', 'real')
+_answer_query = {
+    "real": _real_first,
+    "fallback_first": _fallback_first
+}.get(STRATEGY, _real_first)
+
+async def _respond(user_input):
+    """Shared request pipeline behind both the / and /chat handlers"""
+    early = _guard_input(user_input)
+    if early is not None:
+        return early
+
+    answer, model_used = await _answer_query(user_input)
+
+    if answer and model_used:
+        return jsonify({
+            "answer": answer,
+            "model": model_used,
+            "status": "success",
+            "type": "real_ai"
+        })
+    # Local answer, or every model failed - serve a canned response
+    return jsonify({
+        "answer": answer or get_fallback_response(user_input),
+        "status": "fallback",
+        "type": "fallback"
+    })
+
 @app.route('/')
-def home():
+async def home():
     """Main endpoint - /?ask=Your question"""
     user_input = request.args.get('ask', '').strip()
-    
+
     if not user_input:
         return jsonify({
             "answer": "Hello! I'm powered by real AI models (Mistral-7B, Llama-2, etc.). How can I assist you today?",
@@ -134,60 +493,40 @@ def home():
             "type": "real_ai",
             "usage": "Add ?ask=Your question to the URL"
         })
-    
-    # Generate REAL AI response
-    answer, model_used = generate_ai_response(user_input)
-    
-    if answer:
-        return jsonify({
-            "answer": answer,
-            "model": model_used,
-            "status": "success",
-            "type": "real_ai"
-        })
-    else:
-        return jsonify({
-            "answer": "I'm having trouble connecting to the AI models. Please try again in a moment.",
-            "status": "error",
-            "type": "real_ai"
-        }), 503
+
+    return await _respond(user_input)
 
 @app.route('/chat')
-def chat():
+async def chat():
     """Alternative chat endpoint"""
     user_input = request.args.get('message', '').strip()
-    
+
     if not user_input:
         return jsonify({"error": "No message provided. Use ?message=Your message"}), 400
-    
-    answer, model_used = generate_ai_response(user_input)
-    
-    if answer:
-        return jsonify({
-            "answer": answer,
-            "model": model_used,
-            "status": "success",
-            "type": "real_ai"
-        })
-    else:
-        return jsonify({
-            "answer": "I'm having trouble connecting to the AI models. Please try again.",
-            "status": "error",
-            "type": "real_ai"
-        }), 503
+
+    return await _respond(user_input)
 
 @app.route('/health')
-def health():
+async def health():
     """Health check endpoint"""
     return jsonify({
         "status": "healthy",
         "models_available": MODELS,
+        "cache": {
+            "enabled": DETERMINISTIC,
+            "hits": _CACHE_STATS["hits"],
+            "misses": _CACHE_STATS["misses"]
+        },
+        "guards": {
+            "rejected_oversize": _GUARD_STATS["rejected_oversize"],
+            "rejected_trivial": _GUARD_STATS["rejected_trivial"]
+        },
         "version": "2.0",
         "type": "real_ai"
     })
 
 @app.route('/info')
-def info():
+async def info():
     """API information endpoint"""
     return jsonify({
         "name": "WormAI API - Real AI Models",
@@ -224,4 +563,4 @@ if __name__ == '__main__':
     for m in MODELS:
         print(f"  • {m}")
     print("=" * 60)
-    app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
+    app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,17 @@
+# gunicorn configuration - worker counts and bind come from the Procfile /
+# render.yaml start command
+
+# Import the app once in the master and share its read-only pages across
+# forked workers (lower RSS, faster worker boots)
+preload_app = True
+
+def post_fork(server, worker):
+    # Build per-process network state fresh after fork: an httpx client or
+    # response cache inherited from a preloaded master is not fork-safe
+    import ai
+    ai._get_client()
+    ai._get_resp_cache()
+    # The QueueListener thread started at import lives in the master and
+    # does not survive fork(); without a fresh queue and listener per
+    # worker, records are never drained - logs vanish and the queue grows
+    ai._setup_logging()